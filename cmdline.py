@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import Optional, Tuple, Type
+from typing import Iterable, List, Optional, Tuple, Type
 
 import blessed
 import codecs
 import fcntl
 import io
 import os
+import stat
+import sys
 import termios
 
 from asyncio import (
@@ -21,7 +23,14 @@ from asyncio import (
 
 from asyncio.coroutines import coroutine
 
-from collections import deque
+from functools import lru_cache
+
+from itertools import permutations
+
+from weakref import WeakValueDictionary
+
+
+_DEBUG = False
 
 
 def _debug_fileno(filelike):
@@ -43,7 +52,7 @@ def _debug_mro(obj):
     return ", ".join(_debug_cls(cls) for cls in obj.__class__.__mro__)
 
 
-def _accmode(mode: str) -> int:
+def _parse_accmode(mode: str) -> int:
 
     flags = 0
 
@@ -67,6 +76,37 @@ def _accmode(mode: str) -> int:
         raise ValueError(f"invalid mode {mode!r}")
 
 
+_ACCMODE_TABLE = {
+    ''.join(chars): _parse_accmode(base)
+    for base in ('r', 'w', 'x', 'a', 'r+', 'w+', 'x+', 'a+')
+    for kind in ('', 'b', 't')
+    for chars in permutations(base + kind)
+}
+
+
+def _accmode(mode: str) -> int:
+
+    try:
+        return _ACCMODE_TABLE[mode]
+
+    except KeyError:
+        return _parse_accmode(mode)
+
+
+def _set_non_blocking(fd: int, flags: int) -> None:
+
+    if not flags & os.O_NONBLOCK:
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+@lru_cache(maxsize=8)
+def _incremental_codecs(encoding: str) -> Tuple[Type[codecs.IncrementalDecoder],
+                                                 Type[codecs.IncrementalEncoder]]:
+
+    return (codecs.getincrementaldecoder(encoding),
+            codecs.getincrementalencoder(encoding))
+
+
 class _File:
 
     def __init__(
@@ -74,6 +114,7 @@ class _File:
             mode: str = None,
             encoding: str = None,
             non_blocking: bool = False,
+            file_id: Optional[Tuple[int, int]] = None,
     ) -> None:
 
         if not isinstance(filelike, io.IOBase):
@@ -83,6 +124,7 @@ class _File:
         filelike = self._maybe_bytes(filelike)
         self._maybe_raw(filelike)
         self._maybe_fd(filelike)
+        self._id = file_id
 
         try:
             self.isatty = filelike.isatty()
@@ -94,10 +136,16 @@ class _File:
 
         self._determine_encoding(encoding)
 
-        if non_blocking and self.fd is not None and os.get_blocking(self.fd):
-            os.set_blocking(self.fd, False)
+        if self.fd is not None and (non_blocking or mode is None):
+            flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+
+        else:
+            flags = None
+
+        if non_blocking and flags is not None:
+            _set_non_blocking(self.fd, flags)
 
-        mode, accmode = self._determine_mode(mode)
+        mode, accmode = self._determine_mode(mode, flags)
 
         mode, accmode = self._maybe_raw_from_fd(mode, accmode)
         mode, accmode = self._maybe_bytes_from_raw(mode, accmode)
@@ -178,11 +226,11 @@ class _File:
         if self.encoding is None:
             self.encoding = 'utf-8'
 
-    def _determine_mode(self, mode: Optional[str]) -> Tuple[str, int]:
+    def _determine_mode(self, mode: Optional[str],
+                        flags: Optional[int]) -> Tuple[str, int]:
 
         if mode is None:
-            accmode = (os.O_RDWR if self.fd is None
-                       else fcntl.fcntl(self.fd, fcntl.F_GETFL) & os.O_ACCMODE)
+            accmode = os.O_RDWR if flags is None else flags & os.O_ACCMODE
             mode = ('rb', 'wb', 'r+b')[accmode]
 
         else:
@@ -302,10 +350,15 @@ class _File:
         if other.fd == self.fd:
             return True
 
-        stat1 = os.fstat(self.fd)
-        stat2 = os.fstat(other.fd)
+        return self._file_id() == other._file_id()
+
+    def _file_id(self) -> Tuple[int, int]:
 
-        return stat1.st_dev == stat2.st_dev and stat1.st_ino == stat2.st_ino
+        if self._id is None:
+            st = os.fstat(self.fd)
+            self._id = st.st_dev, st.st_ino
+
+        return self._id
 
     def tty_file(self, mode: str = 'w+') -> io.TextIOBase:
 
@@ -321,6 +374,69 @@ class _File:
                     errors='replace')
 
 
+_ASCII_COMPATIBLE_CODECS = frozenset({'ascii', 'utf-8', 'iso8859-1'})
+
+
+def _ascii_compatible(encoding: str) -> bool:
+    return codecs.lookup(encoding).name in _ASCII_COMPATIBLE_CODECS
+
+
+_shared_files = WeakValueDictionary()
+
+
+def _shared_file(filelike: io.IOBase,
+                 mode: str,
+                 non_blocking: bool = False,
+                 ) -> _File:
+
+    try:
+        fd = filelike.fileno()
+
+    except (AttributeError, OSError):
+        return _File(filelike, mode=mode, non_blocking=non_blocking)
+
+    st = os.fstat(fd)
+    key = fd, st.st_dev, st.st_ino, mode, non_blocking
+
+    file = _shared_files.get(key)
+
+    if file is None:
+        file = _File(filelike,
+                     mode=mode,
+                     non_blocking=non_blocking,
+                     file_id=(st.st_dev, st.st_ino))
+        _shared_files[key] = file
+
+    elif non_blocking:
+        _set_non_blocking(fd, fcntl.fcntl(fd, fcntl.F_GETFL))
+
+    return file
+
+
+_shared_terminals = {}
+
+
+def _shared_terminal(input_file: _File, shared: bool) -> blessed.Terminal:
+
+    key = os.environ.get('TERM'), input_file._file_id(), shared
+
+    try:
+        return _shared_terminals[key]
+
+    except KeyError:
+        pass
+
+    if shared:
+        terminal = blessed.Terminal()
+
+    else:
+        terminal = blessed.Terminal(stream=input_file.tty_file(mode='w'))
+
+    _shared_terminals[key] = terminal
+
+    return terminal
+
+
 class _CmdLineTransport(Transport):
     def __init__(self,
                  loop: AbstractEventLoop,
@@ -334,20 +450,28 @@ class _CmdLineTransport(Transport):
         self._loop = loop
         self._protocol = protocol
 
-        import sys
-        self._input = _File(sys.__stdin__, mode='r', non_blocking=True)
-        self._output = _File(sys.__stdout__, mode='w')
+        self._input = _shared_file(sys.__stdin__, mode='r', non_blocking=True)
+        self._output = _shared_file(sys.__stdout__, mode='w')
 
-        self._input_decoder = codecs.getincrementaldecoder(self._input.encoding)(errors='ignore')
-        self._input_buf = []
+        decoder_factory, _ = _incremental_codecs(self._input.encoding)
+        _, encoder_factory = _incremental_codecs(self._output.encoding)
 
-        self._output_encoder = codecs.getincrementalencoder(self._output.encoding)(errors='ignore')
-        self._output_buf = deque()
+        self._input_decoder = decoder_factory(errors='ignore')
+        self._input_ascii = _ascii_compatible(self._input.encoding)
+        self._input_pending = False
+        self._input_line = io.StringIO()
+        self._read_buf = bytearray(65536)
+
+        self._output_encoder = encoder_factory(errors='ignore')
+        self._output_ascii = _ascii_compatible(self._output.encoding)
+        self._output_buf = bytearray(65536)
+        self._output_head = 0
+        self._output_tail = 0
 
         self._saved_attr = None
-        self._terminal = None
+        self._terminal_instance = None
         self._shared = False
-        self._echo = None
+        self._echo_file = None
 
         if self._input.isatty:
             self._saved_attr = termios.tcgetattr(self._input.fd)
@@ -357,20 +481,28 @@ class _CmdLineTransport(Transport):
             attr[6][termios.VTIME] = 0
             termios.tcsetattr(self._input.fd, termios.TCSADRAIN, attr)
 
-            if self._input == self._output:
-                self._terminal = blessed.Terminal()
-                self._shared = True
-
-            else:
-                self._terminal = blessed.Terminal(
-                        stream=self._input.tty_file(mode='w'),
-                )
-
-            self._echo = _File(self._terminal.stream, mode='w')
+            self._shared = self._input == self._output
 
         self._loop.call_soon(self._protocol.connection_made, self)
         self._loop.call_soon(self._add_reader)
 
+    @property
+    def _terminal(self) -> Optional[blessed.Terminal]:
+
+        if self._terminal_instance is None and self._input.isatty:
+            self._terminal_instance = _shared_terminal(self._input,
+                                                       self._shared)
+
+        return self._terminal_instance
+
+    @property
+    def _echo(self) -> Optional[_File]:
+
+        if self._echo_file is None and self._terminal is not None:
+            self._echo_file = _File(self._terminal.stream, mode='w')
+
+        return self._echo_file
+
     def _add_reader(self) -> None:
 
         try:
@@ -383,79 +515,148 @@ class _CmdLineTransport(Transport):
     def _add_writer(self) -> None:
 
         try:
-            import sys
-            print("adding writer", file=sys.stderr, flush=True)
+            if __debug__ and _DEBUG:
+                print("adding writer", file=sys.stderr, flush=True)
 
             self._loop.add_writer(self._output.fd, self._output_available)
 
         except PermissionError:
             # FIXME: handle case when file descriptor cannot be watched
 
-            import sys
-            print("output file descriptor cannot be watched", file=sys.stderr, flush=True)
+            if __debug__ and _DEBUG:
+                print("output file descriptor cannot be watched",
+                      file=sys.stderr, flush=True)
 
     def _input_available(self) -> None:
 
-        raw_buf = os.read(self._input.fd, 4096)
+        read_buf = self._read_buf
+        lines = []
 
         while True:
-            raw_line, sep, raw_buf = raw_buf.partition(b'\n')
+            try:
+                size = os.readv(self._input.fd, [read_buf])
+
+            except BlockingIOError:
+                break
+
+            self._split_input(size, lines)
 
-            if not sep:
+            if size < len(read_buf):
                 break
 
-            self._input_buf.append(self._input_decoder.decode(raw_line, True))
-            self._input_decoder.reset()
+        if lines:
+            self._deliver_lines(lines)
 
-            self._loop.call_soon(self._protocol.data_received,
-                                 ''.join(self._input_buf))
-            self._input_buf.clear()
+    def _split_input(self, size: int, lines: List[str]) -> None:
 
-        if not raw_line:
+        read_buf = self._read_buf
+        raw_buf = memoryview(read_buf)[:size]
+
+        decode = self._decode_input
+        start = 0
+
+        while True:
+            end = read_buf.find(b'\n', start, size)
+
+            if end < 0:
+                break
+
+            line = decode(raw_buf[start:end], True)
+
+            if self._input_line.tell():
+                self._input_line.write(line)
+                line = self._input_line.getvalue()
+                self._input_line.seek(0)
+                self._input_line.truncate()
+
+            lines.append(line)
+
+            start = end + 1
+
+        if start >= size:
             return
 
-        self._input_buf.append(self._input_decoder.decode(raw_line, False))
+        self._input_line.write(decode(raw_buf[start:], False))
 
-    def _output_available(self) -> None:
+    def _deliver_lines(self, lines: List[str]) -> None:
 
-        if not self._output_buf:
-            self._loop.remove_writer(self._output.fd)
+        for line in lines:
+            protocol = self._protocol
 
-            import sys
-            print("fsync", file=sys.stderr, flush=True)
+            if protocol is None:
+                break
 
             try:
-                os.fsync(self._output.fd)
+                protocol.data_received(line)
+
+            except (SystemExit, KeyboardInterrupt):
+                raise
+
+            except BaseException as exc:
+                self._loop.call_exception_handler({
+                    'message': "protocol.data_received() call failed.",
+                    'exception': exc,
+                    'transport': self,
+                    'protocol': protocol,
+                })
+
+    def _decode_input(self, raw_data: memoryview, final: bool) -> str:
 
-            except OSError:
+        if self._input_ascii and not self._input_pending:
+            try:
+                return str(raw_data, 'ascii')
+
+            except UnicodeDecodeError:
                 pass
 
-            return
+        self._input_pending = not final
 
-        raw_data = self._output_buf.popleft()
-        if not raw_data:
-            import sys
-            print("data empty", file=sys.stderr, flush=True)
+        return self._input_decoder.decode(raw_data, final)
+
+    def _output_available(self) -> None:
+
+        buf = self._output_buf
+        head = self._output_head
+        tail = self._output_tail
+
+        if head >= tail:
+            self._loop.remove_writer(self._output.fd)
 
             return
 
-        bytes_written = os.write(self._output.fd, raw_data[:4096])
-        assert 0 <= bytes_written <= len(raw_data)
+        with memoryview(buf) as view:
+            bytes_written = os.write(self._output.fd,
+                                     view[head:min(tail, head + 4096)])
+
+        assert 0 <= bytes_written <= tail - head
+        head += bytes_written
+
+        if head >= tail:
+            self._output_head = self._output_tail = 0
+            self._loop.remove_writer(self._output.fd)
 
-        if bytes_written >= len(raw_data):
-            import sys
-            print(f"complete write ({bytes_written})", file=sys.stderr, flush=True)
+            if __debug__ and _DEBUG:
+                print(f"complete write ({bytes_written})",
+                      file=sys.stderr, flush=True)
 
             return
 
-        import sys
-        print(f"incomplete write ({bytes_written})", file=sys.stderr, flush=True)
+        if __debug__ and _DEBUG:
+            print(f"incomplete write ({bytes_written})",
+                  file=sys.stderr, flush=True)
 
-        self._output_buf.appendleft(raw_data[bytes_written:])
+        self._output_head = head
 
     def close(self) -> None:
         self._protocol = None
 
+        try:
+            if stat.S_ISREG(os.fstat(self._output.fd).st_mode):
+                os.fsync(self._output.fd)
+
+        except OSError:
+            pass
+
         if self._saved_attr:
             termios.tcsetattr(self._input.fd,
                               termios.TCSAFLUSH,
@@ -471,17 +672,35 @@ class _CmdLineTransport(Transport):
         return self._protocol
 
     def get_write_buffer_size(self):
-        assert False
+        raise NotImplementedError
 
     def set_write_buffer_limits(self, high=None, low=None):
-        assert False
+        raise NotImplementedError
 
     def abort(self):
-        assert False
+        raise NotImplementedError
 
     def can_write_eof(self) -> bool:
         return True
 
+    def _queue_output(self, raw_data: bytes) -> None:
+
+        buf = self._output_buf
+        head = self._output_head
+        tail = self._output_tail
+
+        if head and tail + len(raw_data) > len(buf):
+            size = tail - head
+            buf[:size] = buf[head:tail]
+            tail = size
+            self._output_head = 0
+
+        end = tail + len(raw_data)
+        buf[tail:end] = raw_data
+        self._output_tail = end
+
+        self._add_writer()
+
     def write_eof(self):
 
         raw_data = self._output_encoder.encode('', True)
@@ -490,25 +709,29 @@ class _CmdLineTransport(Transport):
         if not raw_data:
             return
 
-        self._output_buf.append(raw_data)
-        self._add_writer()
+        self._queue_output(raw_data)
 
     def write(self, data: str) -> None:
 
-        raw_data = self._output_encoder.encode(data, True)
-        self._output_encoder.reset()
+        if self._output_ascii and data.isascii():
+            raw_data = data.encode('ascii')
+
+        else:
+            raw_data = self._output_encoder.encode(data)
 
         if not raw_data:
             return
 
-        self._output_buf.append(raw_data)
-        self._add_writer()
+        self._queue_output(raw_data)
+
+    def writelines(self, list_of_data: Iterable[str]) -> None:
+        self.write(''.join(list_of_data))
 
     def pause_reading(self):
-        assert False
+        raise NotImplementedError
 
     def resume_reading(self):
-        assert False
+        raise NotImplementedError
 
 
 class DumbOutput: